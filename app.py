@@ -1,30 +1,40 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-import json
-from redis import Redis
+import orjson
+from redis_pool import CLIENT as redis
 from probability import implied_probability
 from combo_optimizer import generate_2_leg_combos
+from props_cache import sorted_ev_props
 
 app = Flask(__name__)
 CORS(app)
 
-redis = Redis(host='localhost', port=6379, db=0)
-
 def cache_get(key):
     try:
         value = redis.get(key)
         if value:
-            return json.loads(value)
+            return orjson.loads(value)
     except:
         return None
 
+def json_response(data):
+    """Serialize a payload with orjson, which is much faster than jsonify for large prop lists"""
+    return Response(orjson.dumps(data), mimetype="application/json")
+
 @app.route("/api/positive_ev_props")
 def positive_ev_props():
+    try:
+        ev_blob = redis.get("mlb_ev_props_json")
+        if ev_blob:
+            return Response(ev_blob, mimetype="application/json")
+    except:
+        pass
+
     props = cache_get("mlb_enriched_props")
     if not props:
         return jsonify({"error": "No enriched props available"}), 503
-    ev_props = [p for p in props if p.get("edge", 0) > 0.05]
-    return jsonify(ev_props)
+    ev_props = sorted_ev_props(props)
+    return json_response(ev_props)
 
 @app.route("/api/smart_combos")
 def smart_combos():
@@ -32,7 +42,7 @@ def smart_combos():
     if not props:
         return jsonify({"error": "No props available"}), 503
     combos = generate_2_leg_combos(props)
-    return jsonify(combos)
+    return json_response(combos)
 
 @app.route("/")
 def index():
@@ -1,16 +1,41 @@
 from itertools import combinations
+import numpy as np
+
+MAX_COMBOS = 15
+
+# Every pair that uses a prop outside the top MAX_COMBOS + 1 edges is matched or beaten
+# by the MAX_COMBOS pairs its better leg forms inside that prefix, so no other prop
+# can reach the top MAX_COMBOS average edges.
+CANDIDATE_PROPS = MAX_COMBOS + 1
+
+def filter_by_edge(props, min_edge=0.05):
+    """Return the props whose edge beats min_edge, using one vectorized comparison"""
+    edges = np.fromiter((p.get("edge", 0) for p in props), dtype=np.float64, count=len(props))
+    return [props[i] for i in np.flatnonzero(edges > min_edge)]
 
 def generate_2_leg_combos(props):
-    valid_props = [p for p in props if p.get("edge", 0) > 0.05]
-    combos = []
+    valid_props = filter_by_edge(props)
+    valid_props.sort(key=lambda p: p["edge"], reverse=True)
+    candidates = valid_props[:CANDIDATE_PROPS]
+
+    # Work on edges scaled to integer basis points; they are only converted back
+    # to percentages for the combos that are returned
+    scaled = [int(round(p["edge"] * 10000)) for p in candidates]
+    best_pairs = sorted(
+        combinations(range(len(candidates)), 2),
+        key=lambda pair: scaled[pair[0]] + scaled[pair[1]],
+        reverse=True
+    )[:MAX_COMBOS]
 
-    for a, b in combinations(valid_props, 2):
+    combos = []
+    for i, j in best_pairs:
+        a, b = candidates[i], candidates[j]
         combo = {
             "players": [a["player"], b["player"]],
             "props": [a["label"], b["label"]],
-            "edges": [round(a["edge"] * 100, 2), round(b["edge"] * 100, 2)],
-            "avg_edge": round(((a["edge"] + b["edge"]) / 2) * 100, 2)
+            "edges": [scaled[i] / 100, scaled[j] / 100],
+            "avg_edge": round((scaled[i] + scaled[j]) / 200, 2)
         }
         combos.append(combo)
 
-    return sorted(combos, key=lambda x: x["avg_edge"], reverse=True)[:15]
\ No newline at end of file
+    return combos
\ No newline at end of file
@@ -1,10 +1,22 @@
 import requests
-from datetime import datetime
 import logging
+import threading
+import numpy as np
+import orjson
+from cachetools import TTLCache
+from redis_pool import CLIENT as redis
+from probability import count_hits, is_threshold
+from http_client import (
+    get_game_logs, fetch_game_logs_bulk, get_player_ids, search_player_id, is_missing, mark_missing
+)
 
 logger = logging.getLogger(__name__)
 
-MLB_STATS_API = "https://statsapi.mlb.com/api/v1"
+# Hit rates are memoized per process and mirrored to Redis for the other workers
+HIT_RATE_CACHE_TTL = 3600  # 1 hour
+_HIT_RATES = TTLCache(maxsize=4096, ttl=HIT_RATE_CACHE_TTL)
+_PLAYER_SAMPLES = TTLCache(maxsize=4096, ttl=HIT_RATE_CACHE_TTL)
+_HIT_RATES_LOCK = threading.Lock()
 
 STAT_KEY_MAP = {
     "batter_total_bases": "totalBases",
@@ -28,17 +40,7 @@ STAT_KEY_MAP = {
 def get_player_id(player_name):
     """Get MLB player ID from name"""
     try:
-        resp = requests.get(
-            f"{MLB_STATS_API}/people/search", 
-            params={"names": player_name},
-            timeout=10
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        
-        if data.get("people"):
-            return data["people"][0]["id"]
-        return None
+        return search_player_id(player_name)
     except requests.exceptions.RequestException as e:
         logger.error(f"Error fetching player ID for {player_name}: {e}")
         return None
@@ -46,68 +48,44 @@ def get_player_id(player_name):
         logger.error(f"Unexpected error getting player ID for {player_name}: {e}")
         return None
 
-def get_opponent_context(player_id):
-    """Get opponent context for a player"""
-    try:
-        stats_resp = requests.get(
-            f"{MLB_STATS_API}/people/{player_id}/stats",
-            params={
-                "stats": "gameLog",
-                "season": "2025",
-                "group": "hitting"
-            },
-            timeout=10
-        )
-        stats_resp.raise_for_status()
-        data = stats_resp.json()
-        
-        stats = data.get("stats", [])
-        if not stats:
-            return None
-        
-        logs = stats[0].get("splits", [])
-        if not logs:
-            return None
-        
-        latest_game = logs[0]
-        return (
-            latest_game.get("team", {}).get("id"),
-            latest_game.get("opponent", {}).get("id"),
-            latest_game.get("pitcher", {}).get("hand", {}).get("code")
-        )
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching opponent context for player {player_id}: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"Unexpected error getting opponent context for player {player_id}: {e}")
+def get_opponent_context(logs):
+    """Get opponent context for a player from their most recent game log"""
+    if not logs:
         return None
 
+    latest_game = logs[0]
+    return (
+        latest_game.get("team", {}).get("id"),
+        latest_game.get("opponent", {}).get("id"),
+        latest_game.get("pitcher", {}).get("hand", {}).get("code")
+    )
+
+_FALLBACK_RATES = {
+    # Batting stats - based on MLB averages
+    "hits": 0.35,
+    "totalBases": 0.40,
+    "rbi": 0.25,
+    "runs": 0.30,
+    "homeRuns": 0.15,
+    "stolenBases": 0.08,
+    "baseOnBalls": 0.20,
+    "strikeOuts": 0.65,
+    "combinedStats": 0.50,
+    "fantasyPoints": 0.45,
+    
+    # Pitching stats - based on MLB averages  
+    "pitcher_strikeouts": 0.55,
+    "pitcher_hits_allowed": 0.45,
+    "pitcher_earned_runs": 0.35,
+    "pitcher_walks": 0.20,
+    "pitcher_outs": 0.75
+}
+
 def get_fallback_hit_rate(player_name, stat_type, threshold):
     """Generate realistic fallback hit rate based on MLB averages"""
-    fallback_rates = {
-        # Batting stats - based on MLB averages
-        "hits": 0.35,
-        "totalBases": 0.40,
-        "rbi": 0.25,
-        "runs": 0.30,
-        "homeRuns": 0.15,
-        "stolenBases": 0.08,
-        "baseOnBalls": 0.20,
-        "strikeOuts": 0.65,
-        "combinedStats": 0.50,
-        "fantasyPoints": 0.45,
-        
-        # Pitching stats - based on MLB averages  
-        "pitcher_strikeouts": 0.55,
-        "pitcher_hits_allowed": 0.45,
-        "pitcher_earned_runs": 0.35,
-        "pitcher_walks": 0.20,
-        "pitcher_outs": 0.75
-    }
-    
     # Use the MLB stat key for lookup
     mlb_stat_key = STAT_KEY_MAP.get(stat_type, stat_type)
-    base_rate = fallback_rates.get(mlb_stat_key, 0.35)
+    base_rate = _FALLBACK_RATES.get(mlb_stat_key, 0.35)
     
     # Adjust for threshold difficulty
     if threshold >= 5:
@@ -130,89 +108,281 @@ def get_fallback_hit_rate(player_name, stat_type, threshold):
 def get_contextual_hit_rate(player_name, stat_type, threshold=1):
     """Get contextual hit rate for a player with comprehensive fallback support"""
     try:
-        mlb_stat_key = STAT_KEY_MAP.get(stat_type)
-        if not mlb_stat_key:
-            # For unknown stat types, still provide fallback
-            return get_fallback_hit_rate(player_name, stat_type, threshold)
-
-        player_id = get_player_id(player_name)
-        if not player_id:
-            return get_fallback_hit_rate(player_name, stat_type, threshold)
-
-        context = get_opponent_context(player_id)
-        if not context:
-            return get_fallback_hit_rate(player_name, stat_type, threshold)
-
-        team_id, opponent_id, pitcher_hand = context
-
-        # Determine group type based on stat type
-        group_type = "pitching" if stat_type.startswith("pitcher_") else "hitting"
-        
-        # Get game logs
-        logs_resp = requests.get(
-            f"{MLB_STATS_API}/people/{player_id}/stats",
-            params={
-                "stats": "gameLog",
-                "season": "2025",
-                "group": group_type
-            },
-            timeout=10
-        )
-        logs_resp.raise_for_status()
-        logs_data = logs_resp.json()
-        
-        logs = logs_data.get("stats", [{}])[0].get("splits", [])
-        
-        # Get recent games (last 10 games regardless of opponent for better sample size)
-        recent = logs[:10] if logs else []
-
-        if len(recent) < 2:
-            return get_fallback_hit_rate(player_name, stat_type, threshold)
-
-        # Count games where player exceeded threshold
-        over_count = 0
-        for game in recent:
-            game_stat = game.get("stat", {})
-            
-            # Handle special composite stats
-            if mlb_stat_key == "combinedStats":
-                # H+R+RBI calculation
-                stat_value = (game_stat.get("hits", 0) + 
-                            game_stat.get("runs", 0) + 
-                            game_stat.get("rbi", 0))
-            elif mlb_stat_key == "fantasyPoints":
-                # Basic fantasy scoring
-                hits = game_stat.get("hits", 0)
-                doubles = game_stat.get("doubles", 0)
-                triples = game_stat.get("triples", 0)
-                hrs = game_stat.get("homeRuns", 0)
-                singles = max(0, hits - doubles - triples - hrs)
-                
-                stat_value = (singles * 1 + doubles * 2 + triples * 3 + hrs * 4 + 
-                            game_stat.get("rbi", 0) + game_stat.get("runs", 0) + 
-                            game_stat.get("stolenBases", 0) * 2)
-            else:
-                stat_value = game_stat.get(mlb_stat_key, 0)
-            
-            if stat_value >= threshold:
-                over_count += 1
-        
-        hit_rate = round(over_count / len(recent), 2) if recent else 0.0
-        confidence = "High" if hit_rate >= 0.6 else "Medium" if hit_rate >= 0.4 else "Low"
-
-        return {
-            "player": player_name,
-            "stat": mlb_stat_key,
-            "threshold": threshold,
-            "hit_rate": hit_rate,
-            "sample_size": len(recent),
-            "confidence": confidence,
-            "pitcher_hand": pitcher_hand,
-            "opponent_id": opponent_id
-        }
+        return dict(_cached_hit_rate(player_name, stat_type, threshold))
     except requests.exceptions.RequestException as e:
         logger.error(f"Error fetching contextual hit rate for {player_name}: {e}")
         return get_fallback_hit_rate(player_name, stat_type, threshold)
     except Exception as e:
         logger.error(f"Unexpected error in contextual hit rate for {player_name}: {e}")
-        return get_fallback_hit_rate(player_name, stat_type, threshold)
\ No newline at end of file
+        return get_fallback_hit_rate(player_name, stat_type, threshold)
+
+def _hit_rate_cache_key(player_name, stat_type, threshold):
+    return f"ctx::{player_name}::{stat_type}::{threshold}"
+
+def _cached_hit_rate(player_name, stat_type, threshold):
+    """Memoized hit rate lookup, shared with other workers through Redis.
+    Fallbacks are not memoized, so a failed lookup is retried on the next call."""
+    memo_key = (player_name, stat_type, threshold)
+    with _HIT_RATES_LOCK:
+        if memo_key in _HIT_RATES:
+            return _HIT_RATES[memo_key]
+
+    cache_key = _hit_rate_cache_key(player_name, stat_type, threshold)
+    try:
+        cached = redis.get(cache_key)
+        if cached:
+            result = orjson.loads(cached)
+            with _HIT_RATES_LOCK:
+                _HIT_RATES[memo_key] = result
+            return result
+    except Exception as e:
+        logger.warning(f"Redis unavailable for hit rate cache read: {e}")
+
+    result = _fetch_contextual_hit_rate(player_name, stat_type, threshold)
+
+    # Only keep real calculations; fallbacks should be retried here and by other workers
+    if "note" not in result and "error" not in result:
+        with _HIT_RATES_LOCK:
+            _HIT_RATES[memo_key] = result
+        try:
+            redis.setex(cache_key, HIT_RATE_CACHE_TTL, orjson.dumps(result))
+        except Exception as e:
+            logger.warning(f"Failed to cache hit rate in Redis: {e}")
+    return result
+
+def _fetch_contextual_hit_rate(player_name, stat_type, threshold):
+    if not is_threshold(threshold):
+        return _batch_fallback(player_name, stat_type, threshold)
+    if stat_type not in STAT_KEY_MAP:
+        # For unknown stat types, still provide fallback
+        return get_fallback_hit_rate(player_name, stat_type, threshold)
+
+    samples = _player_samples(player_name, stat_type)
+    if samples is None:
+        return get_fallback_hit_rate(player_name, stat_type, threshold)
+
+    # Count games where player exceeded threshold
+    values, context = samples
+    over_count = int(count_hits(values, [threshold])[0])
+    return _hit_rate_result(player_name, stat_type, threshold, over_count, len(values), context)
+
+def _player_samples(player_name, stat_type):
+    """Recent per-game values of a stat with the opponent context, shared by every
+    threshold (Over 0.5, 1.5, ...) of the same player and stat. Only found samples are
+    memoized; lookup errors raise so the next call retries them."""
+    memo_key = (player_name, stat_type)
+    with _HIT_RATES_LOCK:
+        if memo_key in _PLAYER_SAMPLES:
+            return _PLAYER_SAMPLES[memo_key]
+
+    if is_missing(player_name):
+        return None
+
+    player_id = search_player_id(player_name)
+    if not player_id:
+        mark_missing([player_name])
+        return None
+
+    samples = _samples_from_logs(get_game_logs(player_id, _group_for_stat(stat_type)), stat_type)
+    if samples is not None:
+        with _HIT_RATES_LOCK:
+            _PLAYER_SAMPLES[memo_key] = samples
+    return samples
+
+def _samples_from_logs(logs, stat_type):
+    """(values, context) for the recent games in the logs, or None when too few"""
+    context = get_opponent_context(logs)
+    recent = _recent_games(logs)
+    if not context or len(recent) < 2:
+        return None
+
+    values = _stat_values(recent, STAT_KEY_MAP[stat_type]).astype(np.float32)
+    values.setflags(write=False)
+    return values, context
+
+def get_contextual_hit_rates(queries, player_ids=None):
+    """Get contextual hit rates for a batch of (player_name, stat_type, threshold) queries.
+
+    Cached results are read with a single MGET; only the misses are computed, and
+    those are written back in one pipelined round trip. player_ids from an earlier
+    get_player_ids call can be passed in to skip resolving the names again.
+    """
+    queries = list(queries)
+    cache_keys = [_hit_rate_cache_key(*query) for query in queries]
+
+    try:
+        cached = redis.mget(cache_keys) if cache_keys else []
+    except Exception as e:
+        logger.warning(f"Redis unavailable for hit rate cache read: {e}")
+        cached = [None] * len(queries)
+
+    results = [orjson.loads(value) if value else None for value in cached]
+    misses = [i for i, result in enumerate(results) if result is None]
+    if not misses:
+        return results
+
+    computed = _compute_contextual_hit_rates([queries[i] for i in misses], player_ids)
+    for i, result in zip(misses, computed):
+        results[i] = result
+
+    # Only mirror real calculations; fallbacks should be retried later
+    to_cache = [
+        (cache_keys[i], result) for i, result in zip(misses, computed)
+        if "note" not in result and "error" not in result
+    ]
+    if to_cache:
+        try:
+            pipe = redis.pipeline(transaction=False)
+            for cache_key, result in to_cache:
+                pipe.setex(cache_key, HIT_RATE_CACHE_TTL, orjson.dumps(result))
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to cache hit rates in Redis: {e}")
+    return results
+
+def _compute_contextual_hit_rates(queries, player_ids=None):
+    """Compute contextual hit rates for a batch of queries.
+
+    All network work happens up front in parallel (player IDs and game logs), then
+    hit rates are computed from the fetched logs without further I/O.
+    """
+
+    # Phase 1: resolve player IDs and game logs concurrently
+    # Players that just failed to resolve are skipped and get the fallback
+    names = list(dict.fromkeys(
+        name for name, stat_type, _ in queries
+        if stat_type in STAT_KEY_MAP and not is_missing(name)
+    ))
+    if player_ids is None:
+        player_ids = get_player_ids(names)
+    player_ids = {name: player_ids[name] for name in names if name in player_ids}
+
+    ids_by_group = {}
+    for name, stat_type, _ in queries:
+        player_id = player_ids.get(name)
+        if player_id and stat_type in STAT_KEY_MAP:
+            ids_by_group.setdefault(_group_for_stat(stat_type), set()).add(player_id)
+
+    logs_by_group = {}
+    failed_by_group = {}
+    for group, ids in ids_by_group.items():
+        logs_by_group[group], failed_by_group[group] = fetch_game_logs_bulk(ids, group)
+
+    # Only names the search does not know, or IDs a successful hydrate left out, are
+    # missing; lookups and batches that failed are retried on the next call
+    mark_missing(
+        name for name, stat_type, _ in queries
+        if name in player_ids and stat_type in STAT_KEY_MAP
+        and _left_out(player_ids[name], logs_by_group, failed_by_group, _group_for_stat(stat_type))
+    )
+
+    # Phase 2: build per-game stat values once per player and stat, then count
+    # all of that player's thresholds in one vectorized comparison
+    results = [None] * len(queries)
+    samples_by_key = {}
+    pending = {}
+    for i, (player_name, stat_type, threshold) in enumerate(queries):
+        player_id = player_ids.get(player_name)
+        logs = None
+        if stat_type in STAT_KEY_MAP:
+            logs = logs_by_group.get(_group_for_stat(stat_type), {}).get(player_id)
+        if logs is None or not is_threshold(threshold):
+            results[i] = _batch_fallback(player_name, stat_type, threshold)
+            continue
+        key = (player_id, stat_type)
+        try:
+            if key not in samples_by_key:
+                samples_by_key[key] = _samples_from_logs(logs, stat_type)
+        except Exception as e:
+            logger.error(f"Unexpected error in contextual hit rate for {player_name}: {e}")
+            samples_by_key[key] = None
+        if samples_by_key[key] is None:
+            results[i] = _batch_fallback(player_name, stat_type, threshold)
+            continue
+        pending.setdefault(key, []).append(i)
+
+    for key, indices in pending.items():
+        values, context = samples_by_key[key]
+        over_counts = count_hits(values, [queries[i][2] for i in indices])
+        for i, over_count in zip(indices, over_counts.tolist()):
+            player_name, stat_type, threshold = queries[i]
+            results[i] = _hit_rate_result(player_name, stat_type, threshold, over_count, len(values), context)
+    return results
+
+def _left_out(player_id, logs_by_group, failed_by_group, group):
+    """Whether a player is confirmed missing rather than just not fetched"""
+    if not player_id:
+        return True
+    return player_id not in logs_by_group.get(group, {}) and player_id not in failed_by_group.get(group, ())
+
+def _batch_fallback(player_name, stat_type, threshold):
+    """Fallback that reports an error instead of raising (e.g. for a missing line), so one
+    bad prop cannot fail a whole batch and is never cached"""
+    try:
+        return get_fallback_hit_rate(player_name, stat_type, threshold)
+    except Exception as e:
+        logger.error(f"Fallback hit rate failed for {player_name}: {e}")
+        return {
+            "player": player_name,
+            "stat": stat_type,
+            "threshold": threshold,
+            "hit_rate": None,
+            "confidence": "Unknown",
+            "error": f"Contextual calculation failed: {str(e)}"
+        }
+
+def _group_for_stat(stat_type):
+    """Determine group type based on stat type"""
+    return "pitching" if stat_type.startswith("pitcher_") else "hitting"
+
+def _combined_stats(stats):
+    """H+R+RBI calculation"""
+    return stats.sum(axis=1)
+
+def _fantasy_points(stats):
+    """Basic fantasy scoring"""
+    hits, doubles, triples, hrs, rbi, runs, stolen_bases = stats.T
+    singles = np.maximum(0, hits - doubles - triples - hrs)
+    return (singles * 1 + doubles * 2 + triples * 3 + hrs * 4 +
+            rbi + runs + stolen_bases * 2)
+
+def _single_stat(stats):
+    return stats[:, 0]
+
+# Composite stats: the game log fields they need and the function combining them
+COMPOSITE_STATS = {
+    "combinedStats": (("hits", "runs", "rbi"), _combined_stats),
+    "fantasyPoints": (
+        ("hits", "doubles", "triples", "homeRuns", "rbi", "runs", "stolenBases"),
+        _fantasy_points
+    )
+}
+
+def _stat_values(games, mlb_stat_key):
+    """Per-game values of a stat, computed over a stacked (n_games, n_keys) array"""
+    stat_keys, compute = COMPOSITE_STATS.get(mlb_stat_key, ((mlb_stat_key,), _single_stat))
+    stats = np.array(
+        [[game.get("stat", {}).get(key, 0) for key in stat_keys] for game in games],
+        dtype=np.int32
+    ).reshape(len(games), len(stat_keys))
+    return compute(stats)
+
+def _recent_games(logs):
+    """Get recent games (last 10 games regardless of opponent for better sample size)"""
+    return logs[:10] if logs else []
+
+def _hit_rate_result(player_name, stat_type, threshold, over_count, sample_size, context):
+    team_id, opponent_id, pitcher_hand = context
+    hit_rate = round(over_count / sample_size, 2) if sample_size else 0.0
+    confidence = "High" if hit_rate >= 0.6 else "Medium" if hit_rate >= 0.4 else "Low"
+
+    return {
+        "player": player_name,
+        "stat": STAT_KEY_MAP[stat_type],
+        "threshold": threshold,
+        "hit_rate": hit_rate,
+        "sample_size": sample_size,
+        "confidence": confidence,
+        "pitcher_hand": pitcher_hand,
+        "opponent_id": opponent_id
+    }
@@ -1,119 +1,93 @@
 import requests
 from datetime import datetime
+from functools import lru_cache
 import logging
-import json
 import time
+import numpy as np
+from http_client import (
+    get_game_logs, fetch_game_logs_bulk, get_player_ids, redis_player_ids, search_player_id,
+    store_player_ids
+)
 
 logger = logging.getLogger(__name__)
 
-MLB_STATS_API = "https://statsapi.mlb.com/api/v1"
-
-# In-memory cache for player IDs to reduce API calls
-player_id_cache = {}
-player_context_cache = {}
-cache_timeout = 3600  # 1 hour cache timeout
-
 def get_player_id(player_name):
     """Get MLB player ID from name with caching"""
-    # Check cache first
-    cache_key = f"player_id_{player_name}"
-    cached_data = player_id_cache.get(cache_key)
-    if cached_data and (time.time() - cached_data['timestamp']) < cache_timeout:
-        return cached_data['player_id']
-    
     try:
-        response = requests.get(
-            f"{MLB_STATS_API}/people/search", 
-            params={"names": player_name},
-            timeout=10
-        )
-        response.raise_for_status()
-        data = response.json()
-        
-        player_id = None
-        if data.get("people"):
-            player_id = data["people"][0]["id"]
-        
-        # Cache the result
-        player_id_cache[cache_key] = {
-            'player_id': player_id,
-            'timestamp': time.time()
-        }
-        
-        return player_id
+        return _get_player_id_cached(player_name, int(time.time() // 3600))
     except requests.exceptions.RequestException as e:
         logger.error(f"Error fetching player ID for {player_name}: {e}")
-        return None
     except Exception as e:
         logger.error(f"Unexpected error getting player ID for {player_name}: {e}")
-        return None
+    return None
 
-def get_opponent_context(player_id):
-    """Get current opponent context for a player"""
-    try:
-        today = datetime.utcnow().strftime("%Y-%m-%d")
-        schedule_resp = requests.get(
-            f"{MLB_STATS_API}/people/{player_id}/stats",
-            params={
-                "stats": "gameLog",
-                "season": "2025",
-                "group": "hitting"
-            },
-            timeout=10
-        )
-        schedule_resp.raise_for_status()
-        data = schedule_resp.json()
-        
-        logs = data.get("stats", [{}])[0].get("splits", [])
-        
-        for log in logs:
-            if log.get("date") == today:
-                return (
-                    log.get("team", {}).get("id"),
-                    log.get("opponent", {}).get("id"),
-                    log.get("pitcher", {}).get("hand", {}).get("code")
-                )
-        return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching opponent context for player {player_id}: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"Unexpected error getting opponent context for player {player_id}: {e}")
-        return None
+@lru_cache(maxsize=8192)
+def _get_player_id_cached(player_name, hour):
+    # The hour argument only partitions the cache so entries expire hourly. A name the
+    # search does not know is cached as None; failed lookups raise and are retried.
+    player_ids, misses = redis_player_ids([player_name])
+    if misses:
+        player_ids = {player_name: search_player_id(player_name)}
+        store_player_ids(player_ids)
+    return player_ids.get(player_name)
+
+def get_opponent_context(logs):
+    """Get current opponent context for a player from their game logs"""
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    for log in logs:
+        if log.get("date") == today:
+            return (
+                log.get("team", {}).get("id"),
+                log.get("opponent", {}).get("id"),
+                log.get("pitcher", {}).get("hand", {}).get("code")
+            )
+    return None
+
+# Prop bet stat types to MLB Stats API field names
+_STAT_MAPPING = {
+    # Batting stats
+    "batter_hits": "hits",
+    "batter_rbi": "rbi", 
+    "batter_runs": "runs",
+    "batter_home_runs": "homeRuns",
+    "batter_total_bases": "totalBases",
+    "batter_stolen_bases": "stolenBases",
+    "batter_walks": "baseOnBalls",
+    "batter_strikeouts": "strikeOuts",
+    "batter_hits_runs_rbis": "hits_runs_rbis",  # Custom calculation
+    "batter_fantasy_score": "fantasy_score",  # Custom calculation
+    
+    # Pitching stats
+    "pitcher_strikeouts": "strikeOuts",
+    "pitcher_hits_allowed": "hits",
+    "pitcher_earned_runs": "earnedRuns",
+    "pitcher_walks": "baseOnBalls",
+    "pitcher_outs": "outs",
+    
+    # Legacy mappings
+    "hits": "hits",
+    "rbi": "rbi",
+    "runs": "runs",
+    "homeRuns": "homeRuns",
+    "totalBases": "totalBases",
+    "stolenBases": "stolenBases",
+    "strikeOuts": "strikeOuts",
+    "baseOnBalls": "baseOnBalls"
+}
 
 def get_stat_mapping(stat_type):
     """Map prop bet stat types to MLB Stats API field names"""
-    mapping = {
-        # Batting stats
-        "batter_hits": "hits",
-        "batter_rbi": "rbi", 
-        "batter_runs": "runs",
-        "batter_home_runs": "homeRuns",
-        "batter_total_bases": "totalBases",
-        "batter_stolen_bases": "stolenBases",
-        "batter_walks": "baseOnBalls",
-        "batter_strikeouts": "strikeOuts",
-        "batter_hits_runs_rbis": "hits_runs_rbis",  # Custom calculation
-        "batter_fantasy_score": "fantasy_score",  # Custom calculation
-        
-        # Pitching stats
-        "pitcher_strikeouts": "strikeOuts",
-        "pitcher_hits_allowed": "hits",
-        "pitcher_earned_runs": "earnedRuns",
-        "pitcher_walks": "baseOnBalls",
-        "pitcher_outs": "outs",
-        
-        # Legacy mappings
-        "hits": "hits",
-        "rbi": "rbi",
-        "runs": "runs",
-        "homeRuns": "homeRuns",
-        "totalBases": "totalBases",
-        "stolenBases": "stolenBases",
-        "strikeOuts": "strikeOuts",
-        "baseOnBalls": "baseOnBalls"
-    }
-    return mapping.get(stat_type, stat_type)
+    return _STAT_MAPPING.get(stat_type, stat_type)
+
+# Game log fields and per-field weights for the linear custom stats; fantasy_score
+# folds singles = hits - doubles - triples - homeRuns into the weights
+CUSTOM_STAT_WEIGHTS = {
+    "hits_runs_rbis": (("hits", "runs", "rbi"), (1, 1, 1)),
+    "fantasy_score": (
+        ("hits", "doubles", "triples", "homeRuns", "rbi", "runs", "stolenBases", "baseOnBalls"),
+        (1, 1, 2, 3, 1, 1, 2, 1)
+    )
+}
 
 def calculate_custom_stat(game_data, stat_type):
     """Calculate custom composite stats"""
@@ -132,6 +106,15 @@ def calculate_custom_stat(game_data, stat_type):
                 game_data.get("stolenBases", 0) * 2 + game_data.get("baseOnBalls", 0))
     return 0
 
+def _stat_values(games, api_field):
+    """Per-game values of a stat, computed over a stacked (n_games, n_keys) array"""
+    stat_keys, weights = CUSTOM_STAT_WEIGHTS.get(api_field, ((api_field,), (1,)))
+    stats = np.array(
+        [[game.get("stat", {}).get(key, 0) for key in stat_keys] for game in games],
+        dtype=np.int32
+    ).reshape(len(games), len(stat_keys))
+    return stats @ np.array(weights, dtype=np.int32)
+
 def get_confidence_level(hit_rate, sample_size):
     """Determine confidence level based on hit rate and sample size"""
     if sample_size < 5:
@@ -143,38 +126,38 @@ def get_confidence_level(hit_rate, sample_size):
     else:
         return "Low"
 
+# Basic fallback rates based on stat type and threshold
+_FALLBACK_RATES = {
+    "batter_hits": 0.35,
+    "batter_rbi": 0.25,
+    "batter_runs": 0.30,
+    "batter_home_runs": 0.15,
+    "batter_total_bases": 0.40,
+    "batter_stolen_bases": 0.10,
+    "batter_walks": 0.20,
+    "batter_strikeouts": 0.60,
+    "batter_hits_runs_rbis": 0.45,
+    "batter_fantasy_score": 0.50,
+    "pitcher_strikeouts": 0.55,
+    "pitcher_hits_allowed": 0.45,
+    "pitcher_earned_runs": 0.30,
+    "pitcher_walks": 0.25,
+    "pitcher_outs": 0.70,
+    # Legacy mappings
+    "hits": 0.35,
+    "rbi": 0.25,
+    "runs": 0.30,
+    "homeRuns": 0.15,
+    "totalBases": 0.40,
+    "stolenBases": 0.10,
+    "strikeOuts": 0.60,
+    "baseOnBalls": 0.20
+}
+
 def get_fallback_hit_rate(player_name, stat_type, threshold):
     """Generate fallback hit rate using basic heuristics"""
     try:
-        # Basic fallback rates based on stat type and threshold
-        fallback_rates = {
-            "batter_hits": 0.35,
-            "batter_rbi": 0.25,
-            "batter_runs": 0.30,
-            "batter_home_runs": 0.15,
-            "batter_total_bases": 0.40,
-            "batter_stolen_bases": 0.10,
-            "batter_walks": 0.20,
-            "batter_strikeouts": 0.60,
-            "batter_hits_runs_rbis": 0.45,
-            "batter_fantasy_score": 0.50,
-            "pitcher_strikeouts": 0.55,
-            "pitcher_hits_allowed": 0.45,
-            "pitcher_earned_runs": 0.30,
-            "pitcher_walks": 0.25,
-            "pitcher_outs": 0.70,
-            # Legacy mappings
-            "hits": 0.35,
-            "rbi": 0.25,
-            "runs": 0.30,
-            "homeRuns": 0.15,
-            "totalBases": 0.40,
-            "stolenBases": 0.10,
-            "strikeOuts": 0.60,
-            "baseOnBalls": 0.20
-        }
-        
-        base_rate = fallback_rates.get(stat_type, 0.30)
+        base_rate = _FALLBACK_RATES.get(stat_type, 0.30)
         
         # Adjust based on threshold (higher threshold = lower hit rate)
         if threshold >= 5:
@@ -207,73 +190,52 @@ def get_fallback_hit_rate(player_name, stat_type, threshold):
 
 def get_contextual_hit_rate(player_name, stat_type, threshold=1):
     """Get contextual hit rate with comprehensive stat type support and fallback calculations"""
-    try:
-        player_id = get_player_id(player_name)
-        if not player_id:
-            return get_fallback_hit_rate(player_name, stat_type, threshold)
+    return _contextual_hit_rate_for_id(player_name, get_player_id(player_name), stat_type, threshold)
 
-        context = get_opponent_context(player_id)
-        if not context:
-            return get_fallback_hit_rate(player_name, stat_type, threshold)
-        
-        team_id, opponent_id, pitcher_hand = context
+def get_contextual_hit_rates(queries):
+    """Get contextual hit rates for a batch of (player_name, stat_type, threshold) queries.
 
-        # Determine if it's a pitching or batting stat
-        is_pitching_stat = stat_type.startswith("pitcher_")
-        group = "pitching" if is_pitching_stat else "hitting"
+    Player IDs are resolved in one batched lookup, then game logs are fetched in
+    parallel before any hit rate is computed.
+    """
+    queries = list(queries)
 
-        # Get game logs
-        logs_resp = requests.get(
-            f"{MLB_STATS_API}/people/{player_id}/stats",
-            params={
-                "stats": "gameLog",
-                "season": "2025",
-                "group": group
-            },
-            timeout=10
-        )
-        logs_resp.raise_for_status()
-        logs_data = logs_resp.json()
-        
-        logs = logs_data.get("stats", [{}])[0].get("splits", [])
+    # Phase 1: resolve player IDs and game logs up front
+    player_ids = get_player_ids([player_name for player_name, _, _ in queries])
 
-        # Filter for contextual games (same opponent and pitcher handedness)
-        filtered = [
-            game for game in logs[:10]
-            if (game.get("opponent", {}).get("id") == opponent_id and
-                game.get("pitcher", {}).get("hand", {}).get("code") == pitcher_hand)
-        ]
+    ids_by_group = {}
+    for player_name, stat_type, _ in queries:
+        player_id = player_ids.get(player_name)
+        if player_id:
+            ids_by_group.setdefault(_group_for_stat(stat_type), set()).add(player_id)
 
-        if not filtered:
-            return get_fallback_hit_rate(player_name, stat_type, threshold)
+    logs_by_group = {
+        group: fetch_game_logs_bulk(ids, group)[0]
+        for group, ids in ids_by_group.items()
+    }
 
-        # Map stat type to API field name
-        api_field = get_stat_mapping(stat_type)
-        
-        # Count games where player exceeded threshold
-        over_count = 0
-        for game in filtered:
-            game_stat = game.get("stat", {})
-            if api_field in ["hits_runs_rbis", "fantasy_score"]:
-                stat_value = calculate_custom_stat(game_stat, api_field)
-            else:
-                stat_value = game_stat.get(api_field, 0)
-            
-            if stat_value >= threshold:
-                over_count += 1
-        
-        hit_rate = round(over_count / len(filtered), 2) if filtered else 0.0
+    # Phase 2: compute hit rates from the fetched logs
+    results = []
+    for player_name, stat_type, threshold in queries:
+        player_id = player_ids.get(player_name)
+        logs = logs_by_group.get(_group_for_stat(stat_type), {}).get(player_id)
+        if logs is None:
+            results.append(get_fallback_hit_rate(player_name, stat_type, threshold))
+            continue
+        try:
+            results.append(_hit_rate_from_logs(player_name, stat_type, threshold, logs))
+        except Exception as e:
+            logger.error(f"Unexpected error in contextual hit rate for {player_name}: {e}")
+            results.append(get_fallback_hit_rate(player_name, stat_type, threshold))
+    return results
 
-        return {
-            "player": player_name,
-            "stat": stat_type,
-            "threshold": threshold,
-            "hit_rate": hit_rate,
-            "sample_size": len(filtered),
-            "pitcher_hand": pitcher_hand,
-            "opponent_id": opponent_id,
-            "confidence": get_confidence_level(hit_rate, len(filtered))
-        }
+def _contextual_hit_rate_for_id(player_name, player_id, stat_type, threshold):
+    try:
+        if not player_id:
+            return get_fallback_hit_rate(player_name, stat_type, threshold)
+
+        logs = get_game_logs(player_id, _group_for_stat(stat_type))
+        return _hit_rate_from_logs(player_name, stat_type, threshold, logs)
     except requests.exceptions.RequestException as e:
         logger.error(f"Error fetching contextual hit rate for {player_name}: {e}")
         return get_fallback_hit_rate(player_name, stat_type, threshold)
@@ -281,6 +243,48 @@ def get_contextual_hit_rate(player_name, stat_type, threshold=1):
         logger.error(f"Unexpected error in contextual hit rate for {player_name}: {e}")
         return get_fallback_hit_rate(player_name, stat_type, threshold)
 
+def _group_for_stat(stat_type):
+    """Determine if it's a pitching or batting stat"""
+    return "pitching" if stat_type.startswith("pitcher_") else "hitting"
+
+def _hit_rate_from_logs(player_name, stat_type, threshold, logs):
+    """Compute the contextual hit rate from already-fetched game logs"""
+    context = get_opponent_context(logs)
+    if not context:
+        return get_fallback_hit_rate(player_name, stat_type, threshold)
+
+    team_id, opponent_id, pitcher_hand = context
+
+    # Filter for contextual games (same opponent and pitcher handedness)
+    filtered = [
+        game for game in logs[:10]
+        if (game.get("opponent", {}).get("id") == opponent_id and
+            game.get("pitcher", {}).get("hand", {}).get("code") == pitcher_hand)
+    ]
+
+    if not filtered:
+        return get_fallback_hit_rate(player_name, stat_type, threshold)
+
+    # Map stat type to API field name
+    api_field = get_stat_mapping(stat_type)
+    
+    # Count games where player exceeded threshold
+    values = _stat_values(filtered, api_field)
+    over_count = int((values >= threshold).sum())
+    
+    hit_rate = round(over_count / len(filtered), 2) if filtered else 0.0
+
+    return {
+        "player": player_name,
+        "stat": stat_type,
+        "threshold": threshold,
+        "hit_rate": hit_rate,
+        "sample_size": len(filtered),
+        "pitcher_hand": pitcher_hand,
+        "opponent_id": opponent_id,
+        "confidence": get_confidence_level(hit_rate, len(filtered))
+    }
+
 def get_fantasy_hit_rate(player_name, threshold=6):
     """Get fantasy hit rate using total bases as proxy"""
     return get_contextual_hit_rate(player_name, "totalBases", threshold)
\ No newline at end of file
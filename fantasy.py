@@ -1,102 +1,162 @@
 import logging
-import requests
-from datetime import datetime
+import threading
+import numpy as np
+from cachetools import TTLCache
+from probability import count_hits, is_threshold
+from http_client import (
+    get_game_logs, fetch_game_logs_bulk, get_player_ids, search_player_id, is_missing, mark_missing
+)
 
 logger = logging.getLogger(__name__)
 
-MLB_STATS_API = "https://statsapi.mlb.com/api/v1"
+# Game logs only change between games, so per-player samples are reused for an hour
+FANTASY_SAMPLES_TTL = 3600
+_FANTASY_SAMPLES = TTLCache(maxsize=4096, ttl=FANTASY_SAMPLES_TTL)
+_FANTASY_SAMPLES_LOCK = threading.Lock()
 
 def get_player_id(player_name):
     """Get MLB player ID from name"""
     try:
-        resp = requests.get(
-            f"{MLB_STATS_API}/people/search", 
-            params={"names": player_name},
-            timeout=10
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        
-        if data.get("people"):
-            return data["people"][0]["id"]
-        return None
+        return search_player_id(player_name)
     except Exception as e:
         logger.error(f"Error fetching player ID for {player_name}: {e}")
         return None
 
+# Standard fantasy scoring: game log fields and the points each is worth
+FANTASY_STATS = ("hits", "doubles", "triples", "homeRuns", "runs", "rbi",
+                 "stolenBases", "baseOnBalls", "hitByPitch")
+FANTASY_WEIGHTS = np.array([
+    3,  # hits
+    2,  # +2 bonus for doubles
+    5,  # +5 bonus for triples
+    4,  # +4 bonus for home runs
+    2,  # runs
+    2,  # rbi
+    5,  # stolen bases
+    2,  # walks
+    2   # hit by pitch
+], dtype=np.int32)
+
 def calculate_fantasy_points(game_stats):
     """Calculate fantasy points based on standard scoring system"""
     try:
-        # Standard fantasy scoring
-        points = 0
-        
-        # Hitting stats
-        points += game_stats.get("hits", 0) * 3
-        points += game_stats.get("doubles", 0) * 2  # +2 bonus for doubles
-        points += game_stats.get("triples", 0) * 5  # +5 bonus for triples
-        points += game_stats.get("homeRuns", 0) * 4  # +4 bonus for home runs
-        points += game_stats.get("runs", 0) * 2
-        points += game_stats.get("rbi", 0) * 2
-        points += game_stats.get("stolenBases", 0) * 5
-        points += game_stats.get("baseOnBalls", 0) * 2
-        points += game_stats.get("hitByPitch", 0) * 2
-        
-        return points
+        return int(calculate_fantasy_points_bulk([{"stat": game_stats}])[0])
     except Exception as e:
         logger.error(f"Error calculating fantasy points: {e}")
         return 0
 
+def calculate_fantasy_points_bulk(games):
+    """Fantasy points for each game log entry, as one (n_games, n_stats) @ weights product"""
+    stats = np.array(
+        [[game.get("stat", {}).get(key, 0) for key in FANTASY_STATS] for game in games],
+        dtype=np.int32
+    ).reshape(len(games), len(FANTASY_STATS))
+    return stats @ FANTASY_WEIGHTS
+
 def get_fantasy_hit_rate(player_name, threshold=6):
     """Get fantasy hit rate for a player based on real MLB stats"""
     try:
-        player_id = get_player_id(player_name)
-        if not player_id:
+        fantasy_points = _fantasy_samples(player_name)
+        if fantasy_points is None:
             return {"error": f"Player '{player_name}' not found"}
 
-        # Get game logs
-        logs_resp = requests.get(
-            f"{MLB_STATS_API}/people/{player_id}/stats",
-            params={
-                "stats": "gameLog",
-                "season": "2025",
-                "group": "hitting"
-            },
-            timeout=10
-        )
-        logs_resp.raise_for_status()
-        logs_data = logs_resp.json()
-        
-        logs = logs_data.get("stats", [{}])[0].get("splits", [])
-        
-        if not logs:
-            return {
-                "error": "No recent game data found",
-                "player": player_name,
-                "threshold": threshold
-            }
-
-        # Calculate fantasy points for each game
-        games_over_threshold = 0
-        total_games = 0
-        
-        for game in logs[:15]:  # Last 15 games
-            game_stats = game.get("stat", {})
-            fantasy_points = calculate_fantasy_points(game_stats)
-            
-            if fantasy_points >= threshold:
-                games_over_threshold += 1
-            total_games += 1
-        
-        hit_rate = round(games_over_threshold / total_games, 2) if total_games > 0 else 0.0
-        
-        return {
-            "player": player_name,
-            "threshold": threshold,
-            "fantasy_hit_rate": hit_rate,
-            "sample_size": total_games,
-            "games_over": games_over_threshold
-        }
+        return _fantasy_hit_rate_from_points(player_name, threshold, fantasy_points)
         
     except Exception as e:
         logger.error(f"Error calculating fantasy hit rate for {player_name}: {e}")
         return {"error": f"Failed to calculate fantasy hit rate: {str(e)}"}
+
+def _fantasy_samples(player_name):
+    """Fantasy points of a player's recent games, shared by every threshold. Only found
+    samples are memoized; lookup errors raise so the next call retries them."""
+    with _FANTASY_SAMPLES_LOCK:
+        if player_name in _FANTASY_SAMPLES:
+            return _FANTASY_SAMPLES[player_name]
+
+    if is_missing(player_name):
+        return None
+
+    player_id = search_player_id(player_name)
+    if not player_id:
+        mark_missing([player_name])
+        return None
+
+    fantasy_points = _recent_fantasy_points(get_game_logs(player_id, "hitting"))
+    with _FANTASY_SAMPLES_LOCK:
+        _FANTASY_SAMPLES[player_name] = fantasy_points
+    return fantasy_points
+
+def get_fantasy_hit_rates(queries, player_ids=None):
+    """Get fantasy hit rates for a batch of (player_name, threshold) queries,
+    fetching every player's game logs in parallel before computing. player_ids from an
+    earlier get_player_ids call can be passed in to skip resolving the names again."""
+    queries = list(queries)
+
+    # Players that just failed to resolve are reported as not found without a lookup
+    names = list(dict.fromkeys(player_name for player_name, _ in queries if not is_missing(player_name)))
+    if player_ids is None:
+        player_ids = get_player_ids(names)
+    player_ids = {name: player_ids[name] for name in names if name in player_ids}
+    logs_by_id, failed_ids = fetch_game_logs_bulk(player_ids.values(), "hitting")
+    # Names the search does not know and IDs a successful hydrate left out are missing;
+    # failed lookups and batches are not, so the next call retries them
+    mark_missing(
+        name for name, player_id in player_ids.items()
+        if not player_id or (player_id not in logs_by_id and player_id not in failed_ids)
+    )
+
+    # Score each player's games once, however many thresholds are asked about
+    points_by_id = {}
+    results = []
+    for player_name, threshold in queries:
+        player_id = player_ids.get(player_name)
+        if not is_threshold(threshold):
+            results.append(_invalid_threshold(threshold))
+        elif player_name not in player_ids and not is_missing(player_name):
+            results.append({"error": "Failed to calculate fantasy hit rate: player lookup failed"})
+        elif not player_id:
+            results.append({"error": f"Player '{player_name}' not found"})
+        elif player_id not in logs_by_id:
+            results.append({"error": "Failed to calculate fantasy hit rate: game logs unavailable"})
+        else:
+            try:
+                if player_id not in points_by_id:
+                    points_by_id[player_id] = _recent_fantasy_points(logs_by_id[player_id])
+                results.append(_fantasy_hit_rate_from_points(player_name, threshold, points_by_id[player_id]))
+            except Exception as e:
+                logger.error(f"Error calculating fantasy hit rate for {player_name}: {e}")
+                results.append({"error": f"Failed to calculate fantasy hit rate: {str(e)}"})
+    return results
+
+def _recent_fantasy_points(logs):
+    """Fantasy points for each of the last 15 games"""
+    fantasy_points = calculate_fantasy_points_bulk(logs[:15]).astype(np.float32)
+    fantasy_points.setflags(write=False)
+    return fantasy_points
+
+def _invalid_threshold(threshold):
+    return {"error": f"Failed to calculate fantasy hit rate: invalid threshold {threshold!r}"}
+
+def _fantasy_hit_rate_from_points(player_name, threshold, fantasy_points):
+    """Compute the fantasy hit rate from already-scored recent games"""
+    if not is_threshold(threshold):
+        return _invalid_threshold(threshold)
+
+    total_games = len(fantasy_points)
+    if not total_games:
+        return {
+            "error": "No recent game data found",
+            "player": player_name,
+            "threshold": threshold
+        }
+
+    games_over_threshold = int(count_hits(fantasy_points, [threshold])[0])
+    hit_rate = round(games_over_threshold / total_games, 2)
+    
+    return {
+        "player": player_name,
+        "threshold": threshold,
+        "fantasy_hit_rate": hit_rate,
+        "sample_size": total_games,
+        "games_over": games_over_threshold
+    }
@@ -0,0 +1,235 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import orjson
+import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from redis_pool import CLIENT as redis
+
+logger = logging.getLogger(__name__)
+
+MLB_STATS_API = "https://statsapi.mlb.com/api/v1"
+
+# Stats lookups are I/O-bound, so threads overlap the network latency
+MAX_WORKERS = 32
+
+# Shared by every fan-out so worker threads are created once per process
+_POOL = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="mlb-stats")
+
+# Players the MLB Stats API just failed to resolve or return game logs for; their
+# lookups are skipped for a while instead of repeating the failing calls
+_MISSING_PLAYERS = TTLCache(maxsize=2048, ttl=300)
+_MISSING_LOCK = threading.Lock()
+
+# Players per /people hydrate request, keeps the query string a sane length
+HYDRATE_BATCH_SIZE = 50
+
+PLAYER_ID_REDIS_TTL = 86400  # Player IDs rarely change, keep them for a day
+
+def make_session(pool_connections, pool_maxsize, retries):
+    """Build a keep-alive session whose pooled HTTPS connections are reused across calls"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retries
+    ))
+    return session
+
+# Shared keep-alive session for every MLB Stats API call, so TCP and TLS setup is
+# paid once per pooled connection instead of once per request
+SESSION = make_session(
+    pool_connections=32,
+    pool_maxsize=64,
+    retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+)
+
+def map_concurrent(func, items):
+    """Apply func to every item in parallel threads, preserving input order"""
+    return list(_POOL.map(func, items))
+
+def mark_missing(player_names):
+    """Skip these players' lookups until their negative cache entries expire"""
+    with _MISSING_LOCK:
+        for player_name in player_names:
+            _MISSING_PLAYERS[player_name] = True
+
+def is_missing(player_name):
+    with _MISSING_LOCK:
+        return player_name in _MISSING_PLAYERS
+
+def search_player_id(player_name):
+    """Best /people/search match for one name, as a full name may not match exactly.
+    Returns None when the search finds nobody; lookup errors raise."""
+    resp = SESSION.get(
+        f"{MLB_STATS_API}/people/search",
+        params={"names": player_name},
+        timeout=10
+    )
+    resp.raise_for_status()
+    people = orjson.loads(resp.content).get("people", [])
+    return people[0]["id"] if people else None
+
+def get_player_ids(player_names):
+    """Get MLB player IDs for a batch of names with one Redis round trip and one search.
+    Names the search does not know map to None; names whose lookup failed are left out."""
+    names = list(dict.fromkeys(name for name in player_names if name))
+    if not names:
+        return {}
+
+    player_ids, misses = redis_player_ids(names)
+    if not misses:
+        return player_ids
+
+    resolved = {}
+    try:
+        resolved = _search_player_ids(misses)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error fetching player IDs for {len(misses)} players: {e}")
+    except Exception as e:
+        logger.error(f"Unexpected error getting player IDs for {len(misses)} players: {e}")
+
+    store_player_ids(resolved)
+    player_ids.update(resolved)
+    return player_ids
+
+def redis_player_ids(names):
+    """Cached IDs read in a single pipelined round trip, plus the names still to look up"""
+    try:
+        pipe = redis.pipeline(transaction=False)
+        for name in names:
+            pipe.get(f"player_id::{name}")
+        cached = pipe.execute()
+    except Exception as e:
+        logger.warning(f"Redis unavailable for player ID lookup, querying MLB API directly: {e}")
+        return {}, list(names)
+
+    player_ids = {}
+    misses = []
+    for name, value in zip(names, cached):
+        if value is None:
+            misses.append(name)
+        else:
+            player_ids[name] = int(value)
+    return player_ids, misses
+
+def store_player_ids(player_ids):
+    """Write newly found IDs back in a single pipelined round trip"""
+    found = {name: player_id for name, player_id in player_ids.items() if player_id}
+    if not found:
+        return
+    try:
+        pipe = redis.pipeline(transaction=False)
+        for name, player_id in found.items():
+            pipe.setex(f"player_id::{name}", PLAYER_ID_REDIS_TTL, player_id)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to cache player IDs in Redis: {e}")
+
+def _search_player_ids(player_names):
+    """Resolve names with one /people/search call, matching full names exactly.
+    Names without an exact match (accents, suffixes) are retried one at a time so
+    they resolve the same way in a batch as they do alone."""
+    resolved = {}
+    unmatched = player_names
+    if len(player_names) > 1:
+        resp = SESSION.get(
+            f"{MLB_STATS_API}/people/search",
+            params={"names": ",".join(player_names)},
+            timeout=10
+        )
+        resp.raise_for_status()
+
+        ids_by_name = {}
+        for person in orjson.loads(resp.content).get("people", []):
+            full_name = person.get("fullName", "").lower()
+            if full_name and full_name not in ids_by_name:
+                ids_by_name[full_name] = person["id"]
+
+        unmatched = []
+        for name in player_names:
+            player_id = ids_by_name.get(name.lower())
+            if player_id:
+                resolved[name] = player_id
+            else:
+                unmatched.append(name)
+
+    for name, player_id in zip(unmatched, map_concurrent(_try_search_player_id, unmatched)):
+        if player_id is not _LOOKUP_FAILED:
+            resolved[name] = player_id
+    return resolved
+
+_LOOKUP_FAILED = object()
+
+def _try_search_player_id(player_name):
+    """search_player_id for one name of a batch, so a single failure is only left out"""
+    try:
+        return search_player_id(player_name)
+    except Exception as e:
+        logger.error(f"Error fetching player ID for {player_name}: {e}")
+        return _LOOKUP_FAILED
+
+def get_game_logs(player_id, group, season="2025"):
+    """Fetch the gameLog splits for a single player"""
+    resp = SESSION.get(
+        f"{MLB_STATS_API}/people/{player_id}/stats",
+        params={
+            "stats": "gameLog",
+            "season": season,
+            "group": group
+        },
+        timeout=10
+    )
+    resp.raise_for_status()
+    stats = orjson.loads(resp.content).get("stats") or [{}]
+    return stats[0].get("splits", [])
+
+def fetch_game_logs_bulk(player_ids, group, season="2025"):
+    """Fetch gameLog splits for many players with batched /people hydrate requests.
+    Returns the logs by player ID and the set of IDs whose batch failed, so callers can
+    tell a player the API left out from one that was never fetched."""
+    player_ids = list(dict.fromkeys(pid for pid in player_ids if pid))
+    logs_by_id = {}
+    failed_ids = set()
+    if not player_ids:
+        return logs_by_id, failed_ids
+
+    batches = [
+        player_ids[i:i + HYDRATE_BATCH_SIZE]
+        for i in range(0, len(player_ids), HYDRATE_BATCH_SIZE)
+    ]
+    futures = {
+        _POOL.submit(_fetch_hydrated_game_logs, batch, group, season): batch
+        for batch in batches
+    }
+    for future in as_completed(futures):
+        batch = futures[future]
+        try:
+            logs_by_id.update(future.result())
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Error fetching game logs for {len(batch)} players: {e}")
+            failed_ids.update(batch)
+        except Exception as e:
+            logger.error(f"Unexpected error fetching game logs for {len(batch)} players: {e}")
+            failed_ids.update(batch)
+    return logs_by_id, failed_ids
+
+def _fetch_hydrated_game_logs(player_ids, group, season):
+    """Fetch game logs for a batch of players in a single hydrated request"""
+    resp = SESSION.get(
+        f"{MLB_STATS_API}/people",
+        params={
+            "personIds": ",".join(map(str, player_ids)),
+            "hydrate": f"stats(group=[{group}],type=[gameLog],season={season})"
+        },
+        timeout=10
+    )
+    resp.raise_for_status()
+
+    logs_by_id = {}
+    for person in orjson.loads(resp.content).get("people", []):
+        stats = person.get("stats") or [{}]
+        logs_by_id[person["id"]] = stats[0].get("splits", [])
+    return logs_by_id
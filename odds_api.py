@@ -1,12 +1,21 @@
-import requests
 from datetime import datetime, timedelta
 import os
-import json
+import sys
 import logging
+import threading
 import time
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
-from contextual import get_contextual_hit_rate
-from fantasy import get_fantasy_hit_rate
+from functools import lru_cache
+import numpy as np
+import orjson
+from cachetools import TTLCache
+from urllib3.util.retry import Retry
+from http_client import get_player_ids, make_session
+from probability import implied_probabilities
+from contextual import get_contextual_hit_rate, get_contextual_hit_rates
+from fantasy import get_fantasy_hit_rate, get_fantasy_hit_rates
+from props_cache import store_enriched_props
 
 logger = logging.getLogger(__name__)
 
@@ -15,220 +24,303 @@ ODDS_API_KEY = os.getenv("ODDS_API_KEY")
 
 # Preferred sportsbooks for filtering
 PREFERRED_SPORTSBOOKS = ["draftkings", "fanduel", "betmgm"]
-VALID_BOOKS = {"DraftKings", "FanDuel", "BetMGM"}
+_PREFERRED_SPORTSBOOKS_CSV = ",".join(PREFERRED_SPORTSBOOKS)
+_VALID_BOOK_KEYS = frozenset(PREFERRED_SPORTSBOOKS)
 
-def parse_game_data():
-    """Fetch moneylines with preferred sportsbooks first, fallback to all if needed"""
-    now = datetime.utcnow()
+# Targeted markets only (7 markets total). the-odds-api prices any number of markets in
+# one event request, so they all go together for the same quota cost
+PROP_MARKETS = [
+    "batter_hits", "batter_home_runs", "batter_total_bases",
+    "pitcher_strikeouts", "pitcher_earned_runs", "pitcher_outs", "pitcher_hits_allowed"
+]
+_PROP_MARKETS_CSV = ",".join(PROP_MARKETS)
+
+# Parallel event odds fetches, capped at a global request rate instead of sleeping per event
+FETCH_WORKERS = 10
+MAX_REQUESTS_PER_SECOND = 5
+
+# Raw props collected per poll before they are deduplicated and capped mid-fetch
+MAX_PROPS = 20000
+
+# Events enriched concurrently while the remaining events are still downloading
+ENRICH_WORKERS = int(os.getenv("ENRICH_WORKERS", "4"))
+
+# Worker threads are created once per process and reused by every poll
+_FETCH_POOL = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="odds-fetch")
+_ENRICH_POOL = ThreadPoolExecutor(max_workers=ENRICH_WORKERS, thread_name_prefix="enrich")
+
+class _RateLimiter:
+    """Spaces out requests evenly across threads so they never exceed max_per_second"""
+
+    def __init__(self, max_per_second):
+        self._interval = 1.0 / max_per_second
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+_RATE_LIMITER = _RateLimiter(MAX_REQUESTS_PER_SECOND)
+
+# Events and lines move on a minute scale, so short-lived caches skip most repeat calls
+_EVENTS_CACHE = TTLCache(maxsize=16, ttl=60)
+_ODDS_CACHE = TTLCache(maxsize=512, ttl=30)
+# Last ETag seen per request, kept past the 30-minute refresh so the next poll can
+# revalidate; keyed without the commence window, which shifts every minute
+_ETAGS = TTLCache(maxsize=512, ttl=7200)
+_WINDOW_PARAMS = ("commenceTimeFrom", "commenceTimeTo")
+_CACHE_LOCK = threading.Lock()
+
+# Pooled keep-alive session for the-odds-api, one TLS handshake per connection
+_SESSION = make_session(
+    pool_connections=16,
+    pool_maxsize=32,
+    retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+)
+
+def _cached_get(cache, url, params, extract=None):
+    """GET a JSON payload through a TTL cache, revalidating expired entries with
+    their ETag so an unchanged payload costs a 304 instead of a full download.
+    extract, if given, reduces the parsed payload to what is worth caching."""
+    key = (url, tuple(sorted(params.items())))
+    etag_key = (url, tuple(item for item in key[1] if item[0] not in _WINDOW_PARAMS))
+    with _CACHE_LOCK:
+        if key in cache:
+            return cache[key]
+        etag, stale_data = _ETAGS.get(etag_key, (None, None))
+
+    _RATE_LIMITER.wait()
+    headers = {"If-None-Match": etag} if etag else None
+    response = _SESSION.get(url, params=params, headers=headers, timeout=20)
+    if response.status_code == 304 and stale_data is not None:
+        data = stale_data
+    else:
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        if extract:
+            data = extract(data)
+
+    with _CACHE_LOCK:
+        cache[key] = data
+        new_etag = response.headers.get("ETag") or etag
+        if new_etag:
+            _ETAGS[etag_key] = (new_etag, data)
+    return data
+
+@lru_cache(maxsize=1)
+def _commence_window(minute):
+    """Commence-time params for the next 48 hours from a whole minute, so repeated polls
+    build them once and share the cached events response"""
+    now = datetime.utcfromtimestamp(minute * 60)
     future = now + timedelta(hours=48)
-    start_time = now.replace(microsecond=0).isoformat() + "Z"
-    end_time = future.replace(microsecond=0).isoformat() + "Z"
+    return {
+        "commenceTimeFrom": now.isoformat() + "Z",
+        "commenceTimeTo": future.isoformat() + "Z"
+    }
+
+def _event_ids(events):
+    """Only event IDs are needed from the events listing"""
+    return [event["id"] for event in events if event.get("id")]
 
+def parse_game_data():
+    """Fetch moneylines with preferred sportsbooks first, fallback to all if needed"""
     if not ODDS_API_KEY:
-        print("[ERROR] ODDS_API_KEY is not set")
+        logger.error("ODDS_API_KEY is not set")
         return []
 
     # Try preferred sportsbooks first
     try:
-        print(f"[DEBUG] Fetching moneylines from preferred sportsbooks: {PREFERRED_SPORTSBOOKS}")
-        response = requests.get(
+        logger.debug(f"Fetching moneylines from preferred sportsbooks: {PREFERRED_SPORTSBOOKS}")
+        response = _SESSION.get(
             f"{BASE_URL}/sports/baseball_mlb/odds",
             params={
                 "apiKey": ODDS_API_KEY,
                 "regions": "us",
                 "markets": "h2h",
                 "oddsFormat": "american",
-                "commenceTimeFrom": start_time,
-                "commenceTimeTo": end_time,
-                "bookmakers": ",".join(PREFERRED_SPORTSBOOKS)
+                **_commence_window(int(time.time() // 60)),
+                "bookmakers": _PREFERRED_SPORTSBOOKS_CSV
             },
             timeout=20
         )
         response.raise_for_status()
-        data = response.json()
-        print(f"[INFO] Retrieved {len(data)} moneyline matchups from preferred sportsbooks")
+        data = orjson.loads(response.content)
+        logger.info(f"Retrieved {len(data)} moneyline matchups from preferred sportsbooks")
         
         # If we got good data, return it
         if data and len(data) > 0:
             return data
         else:
-            print("[WARNING] No moneylines from preferred sportsbooks, falling back to all sportsbooks")
+            logger.warning("No moneylines from preferred sportsbooks, falling back to all sportsbooks")
             
     except Exception as e:
-        print(f"[ERROR] Failed to fetch odds from preferred sportsbooks: {e}, falling back to all sportsbooks")
+        logger.error(f"Failed to fetch odds from preferred sportsbooks: {e}, falling back to all sportsbooks")
 
     # Fallback to all sportsbooks
     try:
-        print("[DEBUG] Fetching moneylines from all sportsbooks")
-        response = requests.get(
+        logger.debug("Fetching moneylines from all sportsbooks")
+        response = _SESSION.get(
             f"{BASE_URL}/sports/baseball_mlb/odds",
             params={
                 "apiKey": ODDS_API_KEY,
                 "regions": "us",
                 "markets": "h2h",
                 "oddsFormat": "american",
-                "commenceTimeFrom": start_time,
-                "commenceTimeTo": end_time
+                **_commence_window(int(time.time() // 60))
             },
             timeout=20
         )
         response.raise_for_status()
-        data = response.json()
-        print(f"[INFO] Retrieved {len(data)} moneyline matchups from all sportsbooks")
+        data = orjson.loads(response.content)
+        logger.info(f"Retrieved {len(data)} moneyline matchups from all sportsbooks")
         return data
     except Exception as e:
-        print(f"[ERROR] Failed to fetch odds from all sportsbooks: {e}")
+        logger.error(f"Failed to fetch odds from all sportsbooks: {e}")
         return []
 
 def fetch_player_props():
     """Fetch player props with preferred sportsbooks first, fallback to all if needed"""
-    now = datetime.utcnow()
-    future = now + timedelta(hours=48)
-    start_time = now.replace(microsecond=0).isoformat() + "Z"
-    end_time = future.replace(microsecond=0).isoformat() + "Z"
+    props = []
+    for eid, event_props in iter_player_props():
+        props.extend(event_props)
+        if len(props) > MAX_PROPS * 2:
+            props = deduplicate_props(props)[:MAX_PROPS]
+            logger.warning(f"Player props capped at {MAX_PROPS}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Event {eid}: Collected {len(props)} props so far")
 
+    logger.info(f"Final count of player props: {len(props)}")
+    
+    # Debug: Show stat type breakdown
+    if logger.isEnabledFor(logging.DEBUG):
+        stat_counts = Counter(prop.get('stat', 'unknown') for prop in props)
+        logger.debug(f"Props by stat type: {dict(stat_counts)}")
+    return props
+
+def iter_player_props():
+    """Yield (event_id, props) for each event in event order, as soon as its odds arrive.
+    Requests go out in event order under the rate limit, so the events mostly complete
+    in that order too."""
     if not ODDS_API_KEY:
-        print("[ERROR] ODDS_API_KEY is not set")
-        return []
+        logger.error("ODDS_API_KEY is not set")
+        return
 
     try:
-        event_resp = requests.get(
+        event_ids = _cached_get(
+            _EVENTS_CACHE,
             f"{BASE_URL}/sports/baseball_mlb/events",
-            params={
+            {
                 "apiKey": ODDS_API_KEY,
-                "commenceTimeFrom": start_time,
-                "commenceTimeTo": end_time
+                **_commence_window(int(time.time() // 60))
             },
-            timeout=20
+            extract=_event_ids
         )
-        event_resp.raise_for_status()
-        events = event_resp.json()
-        print(f"[INFO] Found {len(events)} events")
+        logger.info(f"Found {len(event_ids)} events")
     except Exception as e:
-        print(f"[ERROR] Failed to fetch MLB events: {e}")
-        return []
+        logger.error(f"Failed to fetch MLB events: {e}")
+        return
+
+    logger.debug(f"Starting prop collection for {len(event_ids)} events")
+    logger.debug(f"Using targeted markets: {PROP_MARKETS}")
 
+    # One request per event, fetched in parallel under a shared rate limit
+    futures = [_FETCH_POOL.submit(_fetch_event_props, eid) for eid in event_ids]
+    for eid, future in zip(event_ids, futures):
+        yield eid, future.result()
+
+def _fetch_event_props(eid):
+    """Fetch every targeted market for one event and flatten it into props"""
     props = []
-    print(f"[DEBUG] Starting prop collection for {len(events)} events")
-    
-    # Define targeted markets only (7 markets total)
-    markets_batch_1 = ["batter_hits", "batter_home_runs", "batter_total_bases"]
-    markets_batch_2 = ["pitcher_strikeouts", "pitcher_earned_runs", "pitcher_outs", "pitcher_hits_allowed"]
-    
-    print(f"[DEBUG] Using targeted markets: {markets_batch_1 + markets_batch_2}")
-    
-    all_markets = [markets_batch_1, markets_batch_2]
-
-    for event in events:
-        eid = event.get("id")
-        if not eid:
-            continue
-
-        # Process each market batch to avoid rate limiting
-        for batch_idx, markets in enumerate(all_markets):
-            try:
-                # Add delay between batches to respect rate limits
-                if batch_idx > 0:
-                    time.sleep(1)
-                
-                odds_resp = requests.get(
-                    f"{BASE_URL}/sports/baseball_mlb/events/{eid}/odds",
-                    params={
-                        "apiKey": ODDS_API_KEY,
-                        "regions": "us",
-                        "markets": ",".join(markets),
-                        "oddsFormat": "american",
-                        "bookmakers": ",".join(PREFERRED_SPORTSBOOKS)
-                    },
-                    timeout=20
-                )
-                odds_resp.raise_for_status()
-                data = odds_resp.json()
-                
-                # Log successful market response
-                if data.get("bookmakers"):
-                    successful_markets = [m.get('key') for m in data.get('bookmakers', [])[0].get('markets', [])]
-                    print(f"[DEBUG] Event {eid} batch {batch_idx} fetched props for markets: {successful_markets}")
-                
-                for book in data.get("bookmakers", []):
-                    book_title = book.get("title", "Unknown")
-                    
-                    # Filter to only valid sportsbooks
-                    if book_title not in VALID_BOOKS:
-                        continue
-                    
-                    for market in book.get("markets", []):
-                        stat = market.get("key")
-                        for outcome in market.get("outcomes", []):
-                            player = outcome.get("description") or outcome.get("name")
-                            price = outcome.get("price")
-                            point = outcome.get("point")
-
-                            if player and price is not None:
-                                props.append({
-                                    "player": player,
-                                    "stat": stat,
-                                    "line": point,
-                                    "odds": price,
-                                    "bookmaker": book_title
-                                })
-                                
-            except Exception as e:
-                print(f"[ERROR] Failed to fetch props for event {eid} batch {batch_idx}: {e}")
-                continue
+    try:
+        data = _cached_get(
+            _ODDS_CACHE,
+            f"{BASE_URL}/sports/baseball_mlb/events/{eid}/odds",
+            {
+                "apiKey": ODDS_API_KEY,
+                "regions": "us",
+                "markets": _PROP_MARKETS_CSV,
+                "oddsFormat": "american",
+                "bookmakers": _PREFERRED_SPORTSBOOKS_CSV
+            }
+        )
+        
+        # Log successful market response
+        if data.get("bookmakers") and logger.isEnabledFor(logging.DEBUG):
+            successful_markets = [m.get('key') for m in data.get('bookmakers', [])[0].get('markets', [])]
+            logger.debug(f"Event {eid} fetched props for markets: {successful_markets}")
         
-        print(f"[DEBUG] Event {eid}: Collected {len(props)} props so far")
+        props = _flatten_props(data.get("bookmakers", []))
 
-    print(f"[INFO] Final count of player props: {len(props)}")
-    print(f"[DEBUG] Final props fetched: {len(props)}")
-    print(f"🔍 DEBUG: Fetched {len(props)} raw props from API")
-    
-    # Debug: Show stat type breakdown
-    stat_counts = {}
-    for prop in props:
-        stat = prop.get('stat', 'unknown')
-        stat_counts[stat] = stat_counts.get(stat, 0) + 1
-    
-    print(f"[DEBUG] Props by stat type: {stat_counts}")
+    except Exception as e:
+        logger.error(f"Failed to fetch props for event {eid}: {e}")
     return props
 
+def _flatten_props(bookmakers):
+    """Flatten the bookmaker -> market -> outcome tree into props for the valid sportsbooks.
+    Interned player, stat and book names are shared by every prop that repeats them, and
+    let dedup and batch-lookup keys compare by identity."""
+    intern = sys.intern
+    return [
+        {
+            "player": intern(player),
+            "stat": stat,
+            "line": outcome.get("point"),
+            "odds": outcome["price"],
+            "bookmaker": title
+        }
+        for book in bookmakers if book.get("key") in _VALID_BOOK_KEYS
+        for title in (intern(book.get("title", book["key"])),)
+        for market in book.get("markets", ())
+        for stat in (market.get("key") and intern(market["key"]),)
+        for outcome in market.get("outcomes", ()) if outcome.get("price") is not None
+        for player in (outcome.get("description") or outcome.get("name"),) if player
+    ]
+
 def deduplicate_props(props):
     """Deduplicate props: keep one prop per unique player+stat+line combination"""
-    unique_props = {}
+    # Number each player+stat+line group in order of first appearance
+    group_ids = {}
+    groups = np.fromiter(
+        (group_ids.setdefault((prop["player"], prop["stat"], prop["line"]), len(group_ids)) for prop in props),
+        dtype=np.intp,
+        count=len(props)
+    )
     
-    for prop in props:
-        # Create unique key for each player+stat+line combination
-        key = f"{prop['player']}_{prop['stat']}_{prop['line']}"
-        
-        # If this is the first occurrence or has better odds, keep it
-        if key not in unique_props:
-            unique_props[key] = prop
-        else:
-            # Keep the prop with better odds (higher absolute value for positive odds)
-            current_odds = unique_props[key]['odds']
-            new_odds = prop['odds']
-            
-            # For positive odds, higher is better; for negative odds, closer to 0 is better
-            if (current_odds > 0 and new_odds > current_odds) or (current_odds < 0 and new_odds > current_odds):
-                unique_props[key] = prop
+    # Lower implied probability means a better payout, for positive and negative odds alike
+    implied = implied_probabilities([prop["odds"] for prop in props])
+    for prop, prop_implied in zip(props, implied.tolist()):
+        prop["implied_probability"] = prop_implied
+    
+    # Sort by group, then by implied probability (stable, so ties keep the earliest prop);
+    # the first row of each group has the best odds
+    order = np.lexsort((implied, groups))
+    sorted_groups = groups[order]
+    is_best = np.ones(len(order), dtype=bool)
+    is_best[1:] = sorted_groups[1:] != sorted_groups[:-1]
     
-    deduplicated = list(unique_props.values())
-    print(f"[INFO] Deduplication: {len(props)} props -> {len(deduplicated)} unique props")
+    deduplicated = [props[i] for i in order[is_best].tolist()]
+    logger.info(f"Deduplication: {len(props)} props -> {len(deduplicated)} unique props")
     return deduplicated
 
-def enrich_prop(prop):
-    """Enrich a single prop with contextual and fantasy hit rates - with robust error handling"""
+def enrich_prop(prop, contextual=None, fantasy=None):
+    """Enrich a single prop with contextual and fantasy hit rates - with robust error handling.
+    Hit rates already fetched by a batch lookup can be passed in to skip the per-prop calls."""
     try:
         # Get contextual hit rate with fallback
-        contextual = None
         try:
-            contextual = get_contextual_hit_rate(
-                prop["player"], 
-                stat_type=prop["stat"], 
-                threshold=prop["line"]
-            )
+            if contextual is None:
+                contextual = get_contextual_hit_rate(
+                    prop["player"], 
+                    stat_type=prop["stat"], 
+                    threshold=prop["line"]
+                )
         except Exception as e:
-            print(f"[WARN] Contextual hit rate error for {prop['player']}: {e}")
+            logger.warning(f"Contextual hit rate error for {prop['player']}: {e}")
             contextual = {
                 "player": prop["player"],
                 "stat": prop["stat"],
@@ -250,11 +342,11 @@ def enrich_prop(prop):
             }
         
         # Get fantasy hit rate with fallback
-        fantasy = None
         try:
-            fantasy = get_fantasy_hit_rate(prop["player"], threshold=prop["line"])
+            if fantasy is None:
+                fantasy = get_fantasy_hit_rate(prop["player"], threshold=prop["line"])
         except Exception as e:
-            print(f"[WARN] Fantasy hit rate error for {prop['player']}: {e}")
+            logger.warning(f"Fantasy hit rate error for {prop['player']}: {e}")
             fantasy = {
                 "player": prop["player"],
                 "threshold": prop["line"],
@@ -281,7 +373,7 @@ def enrich_prop(prop):
             "enriched": True
         }
     except Exception as e:
-        print(f"[ERROR] Failed to enrich prop for {prop.get('player', 'Unknown')}: {e}")
+        logger.error(f"Failed to enrich prop for {prop.get('player', 'Unknown')}: {e}")
         # Return original prop with error indication
         return {
             **prop,
@@ -304,14 +396,61 @@ def enrich_player_props(props):
     if not props:
         return []
     
-    print(f"[INFO] Starting enrichment for {len(props)} props")
+    logger.info(f"Starting enrichment for {len(props)} props")
     
-    # Use ThreadPoolExecutor for parallel processing
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        enriched_props = list(executor.map(enrich_prop, props))
+    # Fetch hit rates for the whole batch up front so the MLB API calls run in parallel;
+    # player IDs are resolved once and shared by both lookups
+    try:
+        player_ids = get_player_ids(p["player"] for p in props)
+        contextuals = get_contextual_hit_rates([(p["player"], p["stat"], p["line"]) for p in props], player_ids)
+        fantasies = get_fantasy_hit_rates([(p["player"], p["line"]) for p in props], player_ids)
+    except Exception as e:
+        logger.warning(f"Batch hit rate lookup failed, enriching props individually: {e}")
+        contextuals = fantasies = [None] * len(props)
+
+    enriched_props = [
+        enrich_prop(prop, contextual, fantasy)
+        for prop, contextual, fantasy in zip(props, contextuals, fantasies)
+    ]
     
     # Count successful enrichments
     successful_enrichments = sum(1 for prop in enriched_props if prop.get("enriched", False))
-    print(f"[INFO] Enrichment complete: {successful_enrichments}/{len(props)} props successfully enriched")
+    logger.info(f"Enrichment complete: {successful_enrichments}/{len(props)} props successfully enriched")
     
-    return enriched_props
\ No newline at end of file
+    return enriched_props
+
+def fetch_enriched_player_props():
+    """Fetch, deduplicate and enrich player props, enriching each event as soon as it
+    arrives so the MLB lookups overlap the remaining odds downloads"""
+    enriched_props = []
+    futures = []
+    remaining = MAX_PROPS
+    for _, event_props in iter_player_props():
+        event_props = deduplicate_props(event_props)[:remaining]
+        remaining -= len(event_props)
+        futures.append(_ENRICH_POOL.submit(enrich_player_props, event_props))
+        if remaining <= 0:
+            logger.warning(f"Player props capped at {MAX_PROPS}")
+            break
+    for future in futures:
+        enriched_props.extend(future.result())
+    return enriched_props
+
+def refresh_enriched_props():
+    """Fetch and enrich today's player props and publish them to the Redis cache the API
+    serves from. The previous payload stays in place until it expires when the fetch is
+    empty or the props are not ready to serve."""
+    props = fetch_enriched_player_props()
+    if not props:
+        logger.warning("No enriched props fetched, keeping the cached payload")
+        return 0
+
+    # /api/positive_ev_props and /api/smart_combos rank by edge and show the label;
+    # publishing props without them would replace the served payload with empty results
+    if not all("edge" in prop and "label" in prop for prop in props):
+        logger.warning("Enriched props have no edge/label yet, keeping the cached payload")
+        return 0
+
+    store_enriched_props(props)
+    logger.info(f"Stored {len(props)} enriched props")
+    return len(props)
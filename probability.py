@@ -1,5 +1,26 @@
+import numpy as np
+
 def implied_probability(odds):
     if odds > 0:
         return 100 / (odds + 100)
     else:
-        return abs(odds) / (abs(odds) + 100)
\ No newline at end of file
+        return abs(odds) / (abs(odds) + 100)
+
+def implied_probabilities(odds):
+    """implied_probability for an array of American odds, without a branch per price"""
+    odds = np.asarray(odds, dtype=np.float64)
+    magnitude = np.abs(odds)
+    return np.where(odds > 0, 100.0, magnitude) / (magnitude + 100.0)
+
+def is_threshold(threshold):
+    """Whether a prop line can be compared against stat samples"""
+    return isinstance(threshold, (int, float)) and not isinstance(threshold, bool) and threshold == threshold
+
+def count_hits(values, thresholds):
+    """Number of samples at or over each threshold, in one vectorized comparison"""
+    if not all(is_threshold(threshold) for threshold in thresholds):
+        # A None line would otherwise cast to NaN and silently count as zero hits
+        raise TypeError(f"Thresholds must be numbers: {thresholds!r}")
+    values = np.asarray(values, dtype=np.float32)
+    thresholds = np.asarray(thresholds, dtype=np.float32)
+    return np.count_nonzero(values[:, None] >= thresholds[None, :], axis=0)
@@ -0,0 +1,28 @@
+import time
+import orjson
+from redis_pool import CLIENT as redis
+from combo_optimizer import filter_by_edge
+
+# Enriched props are refreshed every couple of hours; stale payloads expire with them
+ENRICHED_PROPS_TTL = 7200
+
+def sorted_ev_props(props):
+    """Positive EV props, best edge first"""
+    return sorted(filter_by_edge(props), key=lambda p: p["edge"], reverse=True)
+
+def store_enriched_props(props):
+    """Cache enriched props along with the pre-filtered, pre-sorted and pre-serialized
+    positive EV payload, so /api/positive_ev_props serves the bytes without any work"""
+    ev_props = sorted_ev_props(props)
+
+    # Send every write in one round trip, wrapped in MULTI/EXEC so readers never
+    # see the payload and the EV blob from different refreshes
+    pipe = redis.pipeline(transaction=True)
+    pipe.set("mlb_enriched_props", orjson.dumps(props), ex=ENRICHED_PROPS_TTL)
+    pipe.set("mlb_ev_props_json", orjson.dumps(ev_props), ex=ENRICHED_PROPS_TTL)
+    pipe.set("mlb_enriched_props_ts", int(time.time()))
+    pipe.hset("mlb_enriched_props_meta", mapping={
+        "prop_count": len(props),
+        "ev_prop_count": len(ev_props)
+    })
+    pipe.execute()
@@ -0,0 +1,9 @@
+import os
+import redis
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# One bounded pool per worker process, shared by every module that talks to Redis.
+# Callers wait up to `timeout` seconds for a free connection instead of opening more.
+POOL = redis.BlockingConnectionPool.from_url(REDIS_URL, max_connections=50, timeout=5)
+CLIENT = redis.Redis(connection_pool=POOL)